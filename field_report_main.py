@@ -1,152 +1,159 @@
 import streamlit as st
 from PIL import Image
 import google.generativeai as genai
-from gemini_helper import GeminiInspector
+from gemini_helper import GeminiInspector, RESAMPLE, TABLE_COLLAPSED_MARKER, has_markdown_table
+from session_store import SessionStore
+from pdf_markup import to_reportlab
+import uuid
 
-# PDF generation imports
-from reportlab.lib.pagesizes import letter
-from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib.colors import black, blue, gray
-from reportlab.lib.units import inch
-import io
+# Pixel dimensions are treated as PDF points when an image is embedded in the report
+POINTS_PER_INCH = 72
 
-def resize_image_for_pdf(image, max_width=4*inch, max_height=5*inch):
+def resize_image_for_pdf(image, max_width=4*POINTS_PER_INCH, max_height=5*POINTS_PER_INCH):
     """
     Resize an image to fit within specified maximum dimensions while maintaining aspect ratio.
     
     Args:
         image (PIL.Image): Input image
-        max_width (float): Maximum width in PDF units (inches)
-        max_height (float): Maximum height in PDF units (inches)
+        max_width (float): Maximum width in PDF points
+        max_height (float): Maximum height in PDF points
     
     Returns:
         PIL.Image: Resized image
     """
-    # Convert image to RGB if it's not already
-    if image.mode != 'RGB':
+    # Let JPEG decoding downscale in the DCT domain (no-op for other formats)
+    image.draft('RGB', (int(max_width), int(max_height)))
+    
+    # Palette and bilevel images only resize with nearest-neighbour, so expand them first
+    if image.mode in {'P', '1'}:
         image = image.convert('RGB')
     
     # Get original image dimensions
     orig_width, orig_height = image.size
     
-    # Calculate aspect ratio
-    aspect_ratio = orig_width / orig_height
-    
-    # Calculate new dimensions
-    if orig_width > max_width or orig_height > max_height:
-        # First check width constraint
-        if orig_width > max_width:
-            new_width = max_width
-            new_height = new_width / aspect_ratio
-            
-            # If new height exceeds max height, adjust based on height
-            if new_height > max_height:
-                new_height = max_height
-                new_width = new_height * aspect_ratio
-        
-        # Then check height constraint
-        elif orig_height > max_height:
-            new_height = max_height
-            new_width = new_height * aspect_ratio
-        
-        # Resize the image
-        image = image.resize((int(new_width), int(new_height)), Image.LANCZOS)
+    # Scale to fit within the box, never upscaling
+    scale = min(max_width / orig_width, max_height / orig_height, 1.0)
+    if scale < 1.0:
+        image = image.resize((int(orig_width * scale), int(orig_height * scale)), RESAMPLE)
+    
+    # Convert image to RGB last so it only touches the downscaled pixels
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
     
     return image
 
-def generate_pdf_report(messages, current_image=None):
+def _collapse_for_pdf(messages):
     """
-    Generate a PDF report with clear, professional formatting.
+    Replace all but the most recent assistant classification table with a short marker.
     
     Args:
         messages (list): List of chat messages
-        current_image (PIL.Image, optional): Image to include in the report
     
     Returns:
-        io.BytesIO: PDF report buffer
+        list: Messages with superseded tables collapsed
     """
-    # Create PDF buffer
-    pdf_buffer = io.BytesIO()
-    
-    # Get sample styles and create custom styles
-    styles = getSampleStyleSheet()
-    title_style = styles['Title'].clone('ReportTitle')
-    title_style.fontName = 'Helvetica-Bold'
-    title_style.fontSize = 16
-    title_style.textColor = blue
-    
-    section_header_style = styles['Heading2'].clone('SectionHeader')
-    section_header_style.fontName = 'Helvetica-Bold'
-    section_header_style.textColor = black
-    
-    user_msg_style = ParagraphStyle(
-        'UserMessageStyle',
-        parent=styles['BodyText'],
-        fontName='Helvetica-Bold',
-        fontSize=11,
-        textColor=blue,
-        spaceBefore=12,
-        spaceAfter=6
-    )
+    collapsed = []
+    table_seen = False
+    for msg in reversed(messages):
+        if msg['role'] == 'assistant' and has_markdown_table(msg['content']):
+            if table_seen:
+                msg = {"role": "assistant", "content": TABLE_COLLAPSED_MARKER}
+            table_seen = True
+        collapsed.append(msg)
     
-    assistant_msg_style = ParagraphStyle(
-        'AssistantMessageStyle',
-        parent=styles['BodyText'],
-        fontName='Helvetica',
-        fontSize=11,
-        textColor=black,
-        spaceBefore=12,
-        spaceAfter=6
-    )
+    collapsed.reverse()
+    return collapsed
+
+@st.cache_data(max_entries=4, show_spinner=False)
+def _build_pdf_cached(messages_tuple, image_id, _image=None):
+    """
+    Build the PDF report bytes, memoized on the chat content and image.
+    
+    Args:
+        messages_tuple (tuple): Hashable tuple of (role, content) pairs
+        image_id (str): Identifier of the uploaded image, or None
+        _image (PIL.Image, optional): Page-sized image to include, excluded from the cache key
+    
+    Returns:
+        bytes: PDF report contents
+    """
+    # ReportLab is only imported once a report is actually requested
+    from pdf_report import generate_pdf_report
     
-    # Create PDF document
-    doc = SimpleDocTemplate(
-        pdf_buffer, 
-        pagesize=letter, 
-        rightMargin=54, 
-        leftMargin=54, 
-        topMargin=54, 
-        bottomMargin=36
+    messages = _collapse_for_pdf(
+        [{"role": role, "content": content} for role, content in messages_tuple]
     )
     
-    # Prepare story (PDF content)
-    story = []
+    # Markup was rendered when each message was added; these are memoized lookups
+    for msg in messages:
+        msg['rl_xml'] = to_reportlab(msg['content'])
     
-    # Add title
-    story.append(Paragraph("Construction Invoice/Estimate Analysis Report", title_style))
-    story.append(Spacer(1, 18))
+    return generate_pdf_report(messages, _image).getvalue()
+
+# Bounds of the in-memory chat window rendered on each rerun
+MAX_MESSAGES = 50
+KEEP_MESSAGES = 40
+
+@st.cache_resource(show_spinner=False)
+def get_session_store():
+    """
+    Create the shared session store and start its idle-TTL cleanup once per process.
     
-    # Optional: Add analyzed image to the report
-    if current_image:
-        # Resize image to fit page width
-        resized_image = resize_image_for_pdf(current_image)
-        
-        img_path = "temp_invoice_image.png"
-        resized_image.save(img_path)
-        
-        img = RLImage(img_path, width=None, height=None)
-        img.hAlign = 'CENTER'
-        story.append(img)
-        story.append(Spacer(1, 18))
+    Returns:
+        SessionStore: Store persisting chat transcripts to disk
+    """
+    store = SessionStore()
+    store.start_cleanup()
+    return store
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def get_inspector(api_key):
+    """
+    Create one Gemini inspector per API key and reuse it across reruns.
     
-    # Add chat message sections
-    for msg in messages:
-        # Add section header
-        story.append(Paragraph(msg['role'].capitalize(), section_header_style))
-        
-        # Add message content
-        msg_style = user_msg_style if msg['role'] == 'user' else assistant_msg_style
-        story.append(Paragraph(msg['content'], msg_style))
-        story.append(Spacer(1, 12))
+    Args:
+        api_key (str): Gemini API key, or empty to use GEMINI_API_KEY
+    
+    Returns:
+        GeminiInspector: Configured inspector
+    """
+    return GeminiInspector(api_key or None)
+
+def _archive_marker(count):
+    """
+    Build the placeholder message shown in place of archived messages.
+    
+    Args:
+        count (int): Number of messages archived so far
+    
+    Returns:
+        dict: System message describing the archived messages
+    """
+    return {"role": "system", "content": f"[{count} earlier messages archived]"}
+
+def add_message(role, content):
+    """
+    Persist a chat message and keep a bounded window of messages in memory.
+    
+    Once the window exceeds MAX_MESSAGES, all but the last KEEP_MESSAGES are
+    replaced by a single marker; the full transcript stays in the session store.
     
-    # Build PDF
-    doc.build(story)
+    Args:
+        role (str): Message author, 'user' or 'assistant'
+        content (str): Message text
+    """
+    msg = {"role": role, "content": content}
     
-    # Reset buffer position
-    pdf_buffer.seek(0)
+    # Render the PDF markup now so report builds only hit the memoized result
+    to_reportlab(content)
+    store.append(st.session_state.sid, msg)
     
-    return pdf_buffer
+    messages = st.session_state.messages
+    messages.append(msg)
+    if len(messages) > MAX_MESSAGES:
+        archived = [m for m in messages[:-KEEP_MESSAGES] if m['role'] != 'system']
+        st.session_state.archived_count += len(archived)
+        messages[:] = [_archive_marker(st.session_state.archived_count)] + messages[-KEEP_MESSAGES:]
 
 # Page configuration
 st.set_page_config(
@@ -155,28 +162,59 @@ st.set_page_config(
     layout="wide"
 )
 
+store = get_session_store()
+
+# Identify the session, reusing the id from the URL so a reload resumes the transcript
+if 'sid' not in st.session_state:
+    sid = st.query_params.get("sid")
+    if not SessionStore.is_valid_sid(sid):
+        sid = uuid.uuid4().hex
+        st.query_params["sid"] = sid
+    st.session_state.sid = sid
+
 # Initialize session state
 if 'chat' not in st.session_state:
     st.session_state.chat = None
+if 'chat_api_key' not in st.session_state:
+    st.session_state.chat_api_key = None
 if 'messages' not in st.session_state:
-    st.session_state.messages = []
+    st.session_state.archived_count = max(store.count(st.session_state.sid) - KEEP_MESSAGES, 0)
+    st.session_state.messages = store.recent(st.session_state.sid, KEEP_MESSAGES)
+    if st.session_state.archived_count:
+        st.session_state.messages.insert(0, _archive_marker(st.session_state.archived_count))
 if 'image_analyzed' not in st.session_state:
     st.session_state.image_analyzed = False
 if 'current_image' not in st.session_state:
     st.session_state.current_image = None
+if 'current_image_id' not in st.session_state:
+    st.session_state.current_image_id = None
+if 'prepared_image_id' not in st.session_state:
+    st.session_state.prepared_image_id = None
+if 'current_image_prepared' not in st.session_state:
+    st.session_state.current_image_prepared = None
+if 'current_image_pdf' not in st.session_state:
+    st.session_state.current_image_pdf = None
+if 'pdf_fp' not in st.session_state:
+    st.session_state.pdf_fp = None
+if 'pdf_bytes' not in st.session_state:
+    st.session_state.pdf_bytes = None
 
 # Sidebar for API key
 with st.sidebar:
     st.title("Settings")
     api_key = st.text_input("Enter Gemini API Key", type="password")
-    if api_key:
-        inspector = GeminiInspector(api_key)
-    else:
-        inspector = GeminiInspector()
+    inspector = get_inspector(api_key)
+    
+    # Start a fresh chat when the key changes so it uses the matching model
+    if st.session_state.chat_api_key != api_key:
+        st.session_state.chat = None
+        st.session_state.chat_api_key = api_key
     
     # Add clear chat button
     if st.button("Clear Chat History"):
+        store.clear(st.session_state.sid)
         st.session_state.messages = []
+        st.session_state.archived_count = 0
         st.session_state.chat = inspector.start_chat()
         st.session_state.image_analyzed = False
         st.rerun()
@@ -194,47 +232,104 @@ uploaded_file = st.file_uploader("Upload an invoice/estimate image", type=['png'
 
 # Main interface
 if uploaded_file:
+    # Prepare the upload once per file; a new upload invalidates the cached images
+    if st.session_state.prepared_image_id != uploaded_file.file_id:
+        st.session_state.current_image_prepared = inspector.prepare_image(Image.open(uploaded_file))
+        
+        # Open the upload again so the PDF copy can be drafted straight from the JPEG stream
+        st.session_state.current_image_pdf = resize_image_for_pdf(Image.open(uploaded_file))
+        st.session_state.prepared_image_id = uploaded_file.file_id
+    
     # Display image
-    image = Image.open(uploaded_file)
+    image = st.session_state.current_image_prepared
     st.image(image, caption="Invoice/Estimate Image", use_container_width=True)
     
     # Analyze button
     if not st.session_state.image_analyzed:
         col1, col2 = st.columns([1, 2])
         with col1:
-            if st.button("Analyze Invoice/Estimate", type="primary"):
-                with st.spinner("Analyzing invoice/estimate and assigning cost codes..."):
-                    # Store image for reference
-                    st.session_state.current_image = image
-                    
-                    # Get initial analysis
-                    report = inspector.analyze_image(image, st.session_state.chat)
-                    
-                    # Add the report to chat history
-                    st.session_state.messages.append({"role": "assistant", "content": report})
-                    st.session_state.image_analyzed = True
-                    st.rerun()
+            analyze_clicked = st.button("Analyze Invoice/Estimate", type="primary")
+        
+        if analyze_clicked:
+            with st.spinner("Analyzing invoice/estimate and assigning cost codes..."):
+                # Store image for reference
+                st.session_state.current_image = st.session_state.current_image_pdf
+                st.session_state.current_image_id = uploaded_file.file_id
+                
+                # Stream the initial analysis as it is generated
+                with st.chat_message("assistant"):
+                    report = st.write_stream(inspector.analyze_image(image, st.session_state.chat))
+                
+                # Add the report to chat history
+                add_message("assistant", report)
+                st.session_state.image_analyzed = True
+                st.rerun()
 
-# Display chat history
-st.markdown("### 💬 Invoice/Estimate Analysis Chat")
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
+def report_controls():
+    """
+    Render the PDF report controls.
+    
+    Called from inside the chat fragment so that every chat turn reruns them too,
+    which clears a Download button holding a report built before that turn.
+    """
+    if st.session_state.messages:
+        # Only build the PDF when the user asks for it
+        if st.button("Prepare Analysis Report"):
+            # Cheap fingerprint of the chat and image; rebuild only when it changes
+            msgs = st.session_state.messages
+            pdf_fp = (
+                st.session_state.archived_count + len(msgs),
+                hash(msgs[-1]['content']),
+                st.session_state.current_image_id
+            )
+            if st.session_state.pdf_fp != pdf_fp:
+                # Build (or reuse) the PDF for the full stored transcript and image
+                st.session_state.pdf_bytes = _build_pdf_cached(
+                    tuple((msg['role'], msg['content']) for msg in store.load(st.session_state.sid)),
+                    st.session_state.current_image_id,
+                    st.session_state.current_image
+                )
+                st.session_state.pdf_fp = pdf_fp
+        
+            # Download button for PDF
+            st.download_button(
+                "Download Analysis Report",
+                st.session_state.pdf_bytes,
+                file_name="invoice_analysis.pdf",
+                mime="application/pdf"
+            )
 
-# Chat input
-if st.session_state.image_analyzed:
-    if prompt := st.chat_input("Ask questions about the invoice/estimate analysis..."):
-        # Add user message to chat history
-        st.session_state.messages.append({"role": "user", "content": prompt})
-        with st.chat_message("user"):
-            st.markdown(prompt)
+@st.fragment
+def chat_fragment(inspector):
+    """
+    Render the chat history, input and report controls; chat interactions rerun only this fragment.
+    
+    Args:
+        inspector (GeminiInspector): Inspector used to answer follow-up questions
+    """
+    # Display chat history
+    st.markdown("### 💬 Invoice/Estimate Analysis Chat")
+    for message in st.session_state.messages:
+        with st.chat_message(message["role"]):
+            st.markdown(message["content"])
+    
+    # Chat input
+    if st.session_state.image_analyzed:
+        if prompt := st.chat_input("Ask questions about the invoice/estimate analysis..."):
+            # Add user message to chat history
+            add_message("user", prompt)
+            with st.chat_message("user"):
+                st.markdown(prompt)
+    
+            # Stream and display assistant response
+            with st.chat_message("assistant"):
+                response = st.write_stream(inspector.send_message(st.session_state.chat, prompt))
+                add_message("assistant", response)
+    
+    # Download button for PDF report
+    report_controls()
 
-        # Get and display assistant response
-        with st.chat_message("assistant"):
-            with st.spinner("Analyzing..."):
-                response = inspector.send_message(st.session_state.chat, prompt)
-                st.markdown(response)
-                st.session_state.messages.append({"role": "assistant", "content": response})
+chat_fragment(inspector)
 
 # Footer with instructions
 st.markdown("---")
@@ -253,19 +348,3 @@ Example questions you can ask:
 - Can you break down a specific line item into sub-components?
 - Are there any alternative cost codes that could apply to this item?
 """)
-
-# Download button for PDF report
-if st.session_state.messages:
-    # Create PDF buffer
-    pdf_buffer = generate_pdf_report(
-        st.session_state.messages, 
-        st.session_state.current_image
-    )
-    
-    # Download button for PDF
-    st.download_button(
-        "Download Analysis Report",
-        pdf_buffer,
-        file_name="invoice_analysis.pdf",
-        mime="application/pdf"
-    )
\ No newline at end of file
@@ -1,49 +1,20 @@
 import os
 import google.generativeai as genai
+from google.generativeai import client as genai_client
+from google.api_core import exceptions as api_exceptions
+from google.auth.exceptions import GoogleAuthError
 from dotenv import load_dotenv
 from PIL import Image
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential
 
 # Load environment variables
 load_dotenv()
 
-class GeminiInspector:
-    def __init__(self, api_key=None):
-        # Configure API key
-        if api_key:
-            genai.configure(api_key=api_key)
-        else:
-            genai.configure(api_key=os.getenv("GEMINI_API_KEY"))
-        
-        # Initialize the model with Gemini 2.0
-        self.model = genai.GenerativeModel("gemini-2.0-flash-exp")
-        
-        # Set generation config
-        self.generation_config = {
-            "temperature": 1,
-            "top_p": 0.95,
-            "top_k": 40,
-            "max_output_tokens": 8192,
-        }
-        
-    def prepare_image(self, image):
-        """Prepare the image for Gemini API"""
-        if image.mode != 'RGB':
-            image = image.convert('RGB')
-        
-        max_size = 4096
-        if max(image.size) > max_size:
-            ratio = max_size / max(image.size)
-            new_size = tuple(int(dim * ratio) for dim in image.size)
-            image = image.resize(new_size, Image.Resampling.LANCZOS)
-        
-        return image
+# Resampling filter used when downscaling images; BICUBIC is a faster alternative
+RESAMPLE = Image.Resampling.LANCZOS
 
-    def analyze_image(self, image, chat):
-        """Analyze an invoice image using existing chat session"""
-        try:
-            processed_image = self.prepare_image(image)
-            
-            prompt = """# Construction Invoice and Estimate Cost Code Analysis System
+# Cost code analysis instructions, sent once as the model's system instruction
+_ANALYSIS_PROMPT = """# Construction Invoice and Estimate Cost Code Analysis System
 
 ## System Context and Role
 You are a specialized construction accounting assistant with expertise in residential custom home building. Your primary function is to analyze invoice and estimate images and assign appropriate cost codes based on the standardized cost code structure for residential construction projects. You have been trained on an extensive database of construction terminology, common materials, and standard building practices.
@@ -287,28 +258,176 @@ When confidence is Low:
 5. List any items flagged for review
 6. Suggest improvements for future image submissions
 7. Invite clarifying questions about specific classifications or extractions
-
-Please analyze this invoice or estimate image:
 """
+
+_ANALYSIS_REQUEST = "Please analyze this invoice or estimate image:"
+
+# Number of recent user/assistant turns forwarded to Gemini with each message
+MAX_TURNS = 10
+
+# Text that replaces image parts evicted from older chat history
+IMAGE_EVICTED_MARKER = "[prior invoice image evicted]"
+
+# Text that replaces superseded classification tables
+TABLE_COLLAPSED_MARKER = "[earlier classification table collapsed]"
+
+def has_markdown_table(text):
+    """Check whether text contains a markdown table"""
+    return "|" in text and "---" in text
+
+# Errors reported back to the user instead of crashing the app
+_API_ERRORS = (
+    api_exceptions.GoogleAPIError,
+    GoogleAuthError,
+    genai.types.BlockedPromptException,
+    genai.types.StopCandidateException,
+)
+
+# Transient errors (429, 500, 503) worth retrying before giving up
+_RETRYABLE_ERRORS = (
+    api_exceptions.ResourceExhausted,
+    api_exceptions.InternalServerError,
+    api_exceptions.ServiceUnavailable,
+)
+
+@retry(
+    retry=retry_if_exception_type(_RETRYABLE_ERRORS),
+    wait=wait_exponential(multiplier=0.5, max=2),
+    stop=stop_after_attempt(3),
+    reraise=True,
+)
+def _send_with_retry(chat, content):
+    """Send content to a chat with streaming, retrying transient API failures"""
+    return chat.send_message(content, stream=True)
+
+class GeminiInspector:
+    def __init__(self, api_key=None):
+        api_key = api_key or os.getenv("GEMINI_API_KEY")
+        
+        # Initialize the model with Gemini 2.0
+        self.model = genai.GenerativeModel(
+            "gemini-2.0-flash-exp",
+            system_instruction=_ANALYSIS_PROMPT
+        )
+        
+        # Bind the model to its own client rather than the process-wide genai.configure(),
+        # so inspectors cached for different keys never send requests with each other's key.
+        # Relies on google-generativeai 0.8.3 internals: GenerativeModel only fetches the
+        # default client when _client is None, and _ClientManager.make_client applies the
+        # same client info and default metadata as the SDK's global clients.
+        if api_key:
+            client_manager = genai_client._ClientManager()
+            client_manager.configure(api_key=api_key)
+            self.model._client = client_manager.make_client("generative")
+        
+        # Set generation config
+        self.generation_config = {
+            "temperature": 1,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": 8192,
+        }
+        
+    def prepare_image(self, image):
+        """Prepare the image for Gemini API
+        
+        Small RGB/RGBA images are returned as the same object after being decoded
+        in place; larger images are returned as a downscaled RGB copy.
+        """
+        max_size = 4096
+        
+        # Small RGB/RGBA images can be sent as-is; the SDK encodes them
+        if max(image.size) <= max_size and image.mode in {'RGB', 'RGBA'}:
+            # Decode now so a later draft() on this shared image cannot shrink it
+            image.load()
+            return image
+        
+        # Let JPEG decoding downscale in the DCT domain (no-op for other formats)
+        image.draft('RGB', (max_size, max_size))
+        
+        # Palette and bilevel images only resize with nearest-neighbour, so expand them first
+        if image.mode in {'P', '1'}:
+            image = image.convert('RGB')
+        
+        if max(image.size) > max_size:
+            ratio = max_size / max(image.size)
+            new_size = tuple(int(dim * ratio) for dim in image.size)
+            image = image.resize(new_size, RESAMPLE)
+        
+        # Convert last so it only touches the downscaled pixels
+        if image.mode != 'RGB':
+            image = image.convert('RGB')
+        
+        return image
+
+    def _stream_text(self, response):
+        """Yield the text of each streamed response chunk"""
+        for chunk in response:
+            if chunk.parts:
+                yield chunk.text
+
+    def analyze_image(self, image, chat):
+        """Analyze an invoice image using existing chat session, yielding text as it streams"""
+        try:
+            processed_image = self.prepare_image(image)
+            
+            # Each analysis starts from a clean history
+            chat.history = []
             
-            # Send the message with image to the existing chat
-            response = chat.send_message([prompt, processed_image])
-            return response.text
+            # Send the image to the existing chat; instructions live in the system prompt
+            response = _send_with_retry(chat, [_ANALYSIS_REQUEST, processed_image])
+            yield from self._stream_text(response)
             
-        except Exception as e:
-            return f"Error analyzing image: {str(e)}\nDetails: Please ensure your API key is valid and you're using a supported image format."
+        except _API_ERRORS as e:
+            self.discard_broken_turn(chat)
+            yield f"Error analyzing image: {str(e)}\nDetails: Please ensure your API key is valid and you're using a supported image format."
 
     def start_chat(self):
         """Start a new chat session"""
+        return self.model.start_chat(history=[])
+
+    def discard_broken_turn(self, chat):
+        """Drop the last turn if its streamed response failed or was abandoned, so later messages can be sent"""
         try:
-            return self.model.start_chat(history=[])
-        except Exception as e:
-            return None
+            chat.history
+        except genai.types.IncompleteIterationError:
+            # A rerun abandoned the stream mid-way; finish it so rewind() can read the
+            # response, then drop the turn since the app never recorded that reply
+            try:
+                chat.last.resolve()
+            except _API_ERRORS:
+                pass
+            chat.rewind()
+        except genai.types.BrokenResponseError:
+            chat.rewind()
+
+    def trim_history(self, chat):
+        """Keep only the last MAX_TURNS turns, the most recent image and the most recent table in chat history"""
+        history = chat.history[-2 * MAX_TURNS:]
+        
+        # Walk newest to oldest, replacing all but the latest image and table with markers
+        image_seen = False
+        table_seen = False
+        for content in reversed(history):
+            for part in content.parts:
+                if "inline_data" in part:
+                    if image_seen:
+                        part.text = IMAGE_EVICTED_MARKER
+                    image_seen = True
+                elif content.role == "model" and has_markdown_table(part.text):
+                    if table_seen:
+                        part.text = TABLE_COLLAPSED_MARKER
+                    table_seen = True
+        
+        chat.history = history
 
     def send_message(self, chat, message):
-        """Send a message to the chat session"""
+        """Send a message to the chat session, yielding the response text as it streams"""
         try:
-            response = chat.send_message(message)
-            return response.text
-        except Exception as e:
-            return f"Error sending message: {str(e)}"
\ No newline at end of file
+            self.discard_broken_turn(chat)
+            self.trim_history(chat)
+            response = _send_with_retry(chat, message)
+            yield from self._stream_text(response)
+        except _API_ERRORS as e:
+            self.discard_broken_turn(chat)
+            yield f"Error sending message: {str(e)}"
\ No newline at end of file
@@ -0,0 +1,31 @@
+from functools import lru_cache
+from xml.sax.saxutils import escape as xml_escape
+import re
+
+# Kept free of ReportLab imports so the app can render markup as messages arrive.
+# Imported modules outlive Streamlit reruns, so the memoized results do too.
+
+_BOLD_PATTERN = re.compile(r"\*\*(.+?)\*\*")
+
+@lru_cache(maxsize=256)
+def to_reportlab(content):
+    """
+    Convert message markdown to ReportLab paragraph markup.
+    
+    Escapes XML special characters, turns **bold** into <b> tags and renders
+    markdown table rows in a monospaced font, one line per row.
+    
+    Args:
+        content (str): Message text in markdown
+    
+    Returns:
+        str: Markup safe to pass to a ReportLab Paragraph
+    """
+    lines = []
+    for line in content.splitlines():
+        line = _BOLD_PATTERN.sub(r"<b>\1</b>", xml_escape(line))
+        if line.lstrip().startswith("|"):
+            line = f'<font face="Courier">{line}</font>'
+        lines.append(line)
+    
+    return "<br/>".join(lines)
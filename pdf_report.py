@@ -0,0 +1,107 @@
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Paragraph, Spacer, Image as RLImage
+from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.colors import black, blue
+from reportlab import rl_config
+from pdf_markup import to_reportlab
+import io
+
+# Skip per-attribute validation inside ReportLab flowables
+rl_config.shapeChecking = 0
+
+# Report styles, built once when the module is first imported
+_STYLES = getSampleStyleSheet()
+
+_TITLE_STYLE = _STYLES['Title'].clone('ReportTitle')
+_TITLE_STYLE.fontName = 'Helvetica-Bold'
+_TITLE_STYLE.fontSize = 16
+_TITLE_STYLE.textColor = blue
+
+_SECTION_HEADER_STYLE = _STYLES['Heading2'].clone('SectionHeader')
+_SECTION_HEADER_STYLE.fontName = 'Helvetica-Bold'
+_SECTION_HEADER_STYLE.textColor = black
+
+_USER_MSG_STYLE = ParagraphStyle(
+    'UserMessageStyle',
+    parent=_STYLES['BodyText'],
+    fontName='Helvetica-Bold',
+    fontSize=11,
+    textColor=blue,
+    spaceBefore=12,
+    spaceAfter=6
+)
+
+_ASSISTANT_MSG_STYLE = ParagraphStyle(
+    'AssistantMessageStyle',
+    parent=_STYLES['BodyText'],
+    fontName='Helvetica',
+    fontSize=11,
+    textColor=black,
+    spaceBefore=12,
+    spaceAfter=6
+)
+
+def generate_pdf_report(messages, current_image=None):
+    """
+    Generate a PDF report with clear, professional formatting.
+    
+    Args:
+        messages (list): List of chat messages, optionally carrying pre-rendered 'rl_xml' markup
+        current_image (PIL.Image, optional): Page-sized RGB image to include in the report
+    
+    Returns:
+        io.BytesIO: PDF report buffer
+    """
+    # Create PDF buffer
+    pdf_buffer = io.BytesIO()
+    
+    # Create PDF document
+    doc = SimpleDocTemplate(
+        pdf_buffer, 
+        pagesize=letter, 
+        rightMargin=54, 
+        leftMargin=54, 
+        topMargin=54, 
+        bottomMargin=36
+    )
+    
+    # Prepare story (PDF content)
+    story = []
+    
+    # Add title
+    story.append(Paragraph("Construction Invoice/Estimate Analysis Report", _TITLE_STYLE))
+    story.append(Spacer(1, 18))
+    
+    # Optional: Add analyzed image to the report
+    if current_image:
+        # Encode in memory as JPEG instead of round-tripping a PNG through disk
+        img_buffer = io.BytesIO()
+        current_image.save(img_buffer, format='JPEG', quality=80, optimize=False)
+        img_buffer.seek(0)
+        
+        img = RLImage(img_buffer, width=current_image.width, height=current_image.height)
+        img.hAlign = 'CENTER'
+        story.append(img)
+        story.append(Spacer(1, 18))
+    
+    # Add chat message sections: header, content and spacing for each message
+    story.extend(
+        item
+        for msg in messages
+        for item in (
+            Paragraph(msg['role'].capitalize(), _SECTION_HEADER_STYLE),
+            Paragraph(
+                msg.get('rl_xml') or to_reportlab(msg['content']),
+                _USER_MSG_STYLE if msg['role'] == 'user' else _ASSISTANT_MSG_STYLE
+            ),
+            Spacer(1, 12),
+        )
+    )
+    
+    # Build PDF
+    doc.build(story)
+    
+    # Reset buffer position
+    pdf_buffer.seek(0)
+    
+    return pdf_buffer
@@ -0,0 +1,115 @@
+import json
+import os
+import re
+import threading
+import time
+from collections import deque
+
+# Directory holding one JSON Lines transcript per session
+SESSION_DIR = os.path.join("data", "sessions")
+
+# Sessions untouched for this many seconds are removed by the cleanup sweep
+SESSION_TTL = 24 * 60 * 60
+
+# Seconds between cleanup sweeps
+CLEANUP_INTERVAL = 15 * 60
+
+# Session ids are generated as uuid4 hex strings
+_SID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+class SessionStore:
+    def __init__(self, directory=SESSION_DIR, ttl=SESSION_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        os.makedirs(self.directory, exist_ok=True)
+
+    @staticmethod
+    def is_valid_sid(sid):
+        """Check that a session id is safe to use as a file name"""
+        return bool(sid) and _SID_PATTERN.match(sid) is not None
+
+    def _path(self, sid):
+        """Path of the JSON Lines transcript for a session"""
+        if not self.is_valid_sid(sid):
+            raise ValueError(f"Invalid session id: {sid!r}")
+        return os.path.join(self.directory, f"{sid}.jsonl")
+
+    def _lines(self, sid):
+        """Yield the non-empty lines of a session's transcript"""
+        try:
+            with open(self._path(sid), encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        yield line
+        except FileNotFoundError:
+            return
+
+    def _parse(self, lines):
+        """Decode transcript lines, skipping any left partial by an interrupted write"""
+        messages = []
+        for line in lines:
+            try:
+                messages.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+        return messages
+
+    def load(self, sid):
+        """Load the full message list for a session"""
+        with self._lock:
+            return self._parse(self._lines(sid))
+
+    def recent(self, sid, n=10):
+        """Return the last n messages of a session without decoding the rest"""
+        with self._lock:
+            return self._parse(deque(self._lines(sid), maxlen=n))
+
+    def count(self, sid):
+        """Number of message lines stored for a session"""
+        with self._lock:
+            return sum(1 for _ in self._lines(sid))
+
+    def append(self, sid, msg):
+        """Append a message to a session's transcript as one JSON line"""
+        data = (json.dumps(msg, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            with open(self._path(sid), "ab+") as f:
+                # Start on a fresh line if an interrupted write left the last one unterminated
+                end = f.seek(0, os.SEEK_END)
+                if end:
+                    f.seek(end - 1)
+                    if f.read(1) != b"\n":
+                        data = b"\n" + data
+                f.write(data)
+
+    def clear(self, sid):
+        """Delete a session's transcript"""
+        with self._lock:
+            try:
+                os.remove(self._path(sid))
+            except FileNotFoundError:
+                pass
+
+    def sweep(self):
+        """Remove transcripts that have been idle for longer than the TTL"""
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    try:
+                        os.remove(entry.path)
+                    except FileNotFoundError:
+                        pass
+
+    def start_cleanup(self, interval=CLEANUP_INTERVAL):
+        """Run the idle-TTL sweep in the background every interval seconds"""
+        def run():
+            try:
+                self.sweep()
+            finally:
+                self.start_cleanup(interval)
+
+        timer = threading.Timer(interval, run)
+        timer.daemon = True
+        timer.start()
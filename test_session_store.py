@@ -0,0 +1,88 @@
+import os
+import time
+import uuid
+
+import pytest
+
+from session_store import SessionStore
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SessionStore(directory=str(tmp_path))
+
+
+@pytest.fixture
+def sid():
+    return uuid.uuid4().hex
+
+
+def test_append_and_load_round_trip(store, sid):
+    messages = [
+        {"role": "user", "content": "What code is drywall?"},
+        {"role": "assistant", "content": "| Item | Code |\n|---|---|\n| Drywall | 70050 |"},
+    ]
+    for msg in messages:
+        store.append(sid, msg)
+
+    assert store.load(sid) == messages
+
+
+def test_load_missing_session_is_empty(store, sid):
+    assert store.load(sid) == []
+    assert store.recent(sid, 5) == []
+    assert store.count(sid) == 0
+
+
+def test_recent_and_count(store, sid):
+    for i in range(5):
+        store.append(sid, {"role": "user", "content": str(i)})
+
+    assert [m["content"] for m in store.recent(sid, 2)] == ["3", "4"]
+    assert len(store.recent(sid, 10)) == 5
+    assert store.count(sid) == 5
+
+
+def test_append_after_partial_line_keeps_new_message(store, sid):
+    store.append(sid, {"role": "user", "content": "first"})
+    with open(store._path(sid), "a", encoding="utf-8") as f:
+        f.write('{"role": "assist')
+
+    store.append(sid, {"role": "user", "content": "second"})
+
+    assert [m["content"] for m in store.load(sid)] == ["first", "second"]
+
+
+def test_clear_removes_transcript(store, sid):
+    store.append(sid, {"role": "user", "content": "hi"})
+    store.clear(sid)
+    store.clear(sid)
+
+    assert store.load(sid) == []
+
+
+def test_sweep_removes_only_idle_sessions(store):
+    idle_sid, active_sid = uuid.uuid4().hex, uuid.uuid4().hex
+    store.append(idle_sid, {"role": "user", "content": "old"})
+    store.append(active_sid, {"role": "user", "content": "new"})
+
+    past = time.time() - store.ttl - 60
+    os.utime(store._path(idle_sid), (past, past))
+    store.sweep()
+
+    assert store.load(idle_sid) == []
+    assert store.load(active_sid) == [{"role": "user", "content": "new"}]
+
+
+def test_is_valid_sid_accepts_uuid_hex():
+    assert SessionStore.is_valid_sid(uuid.uuid4().hex)
+
+
+@pytest.mark.parametrize("sid", [None, "", "../etc/passwd", "ABC", uuid.uuid4().hex + "0", str(uuid.uuid4())])
+def test_is_valid_sid_rejects_unsafe_ids(sid):
+    assert not SessionStore.is_valid_sid(sid)
+
+
+def test_invalid_sid_is_rejected_on_access(store):
+    with pytest.raises(ValueError):
+        store.append("../escape", {"role": "user", "content": "x"})